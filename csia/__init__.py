@@ -6,7 +6,10 @@ from flask import Flask, render_template
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
-        SECRET_KEY="dev", DATABASE=os.path.join(app.instance_path, "csia.sqlite")
+        SECRET_KEY="dev",
+        DATABASE=os.path.join(app.instance_path, "csia.sqlite"),
+        DATABASE_POOL_SIZE=8,  # Idle connections kept open for reuse between requests
+        CACHE_TYPE="SimpleCache",
     )
 
     if test_config is None:
@@ -26,6 +29,10 @@ def create_app(test_config=None):
 
     db.init_app(app)
 
+    from .cache import cache
+
+    cache.init_app(app)
+
     from . import auth
 
     app.register_blueprint(auth.bp)
@@ -11,12 +11,53 @@ from flask import (
     url_for,
 )
 
-from werkzeug.security import check_password_hash, generate_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from werkzeug.security import check_password_hash
 
-from csia.db import get_db
+from csia.db import get_db, write_transaction
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# Argon2id with web-tuned parameters (2 passes over 19 MiB), memory-hard instead of
+# relying on hundreds of thousands of PBKDF2 iterations
+_ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+
+def hash_password(password):
+    """
+    Hashes a password with Argon2id for storing in the user table.
+    """
+    return _ph.hash(password)
+
+
+def verify_password(password_hash, password):
+    """
+    Checks a password against a stored hash.
+    Returns True if the password matches, False otherwise.
+    """
+    # Rows created before the switch to Argon2id hold werkzeug hashes ("scrypt:..." / "pbkdf2:...")
+    if not password_hash.startswith("$argon2"):
+        return check_password_hash(password_hash, password)
+
+    try:
+        return _ph.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def password_needs_rehash(password_hash):
+    """
+    Checks if a stored hash should be replaced, because it is an old werkzeug hash
+    or an Argon2 hash made with different parameters.
+    """
+    return not password_hash.startswith("$argon2") or _ph.check_needs_rehash(password_hash)
+
+
+# Hash checked against when the name is not found, so a login attempt for an unknown
+# user takes as long as one with a wrong password and doesn't reveal which names exist
+_DUMMY_HASH = hash_password("dummy-password")
+
 
 @bp.route("/register", methods=("GET", "POST"))
 def register():
@@ -43,24 +84,24 @@ def register():
             error = "Location is required."
 
         if error is None:
+            # Hash the password for security, before the write lock is taken
+            password_hash = hash_password(password)
             try: # Catch a database integrity error if username already exists
-                # Insert into user table
-                db.execute(
-                    "INSERT INTO user (name, password) VALUES (?, ?)",
-                    (name, generate_password_hash(password)), # Hash the password for security
-                )
-                # Get the user_id of the newly inserted user
-                user_id = db.execute(
-                    "SELECT user_id FROM user WHERE name = ?", (name,)
-                ).fetchone()["user_id"]
-
-                # Insert into requester table with the user_id
-                db.execute(
-                    "INSERT INTO requester (user_id, region, location) VALUES (?, ?, ?)",
-                    (user_id, region, location),
-                )
-                db.commit()
-            except db.IntegrityError: # User name already exists
+                with write_transaction(): # Both inserts commit together
+                    # Insert into user table, keeping the cursor to read back the new user_id
+                    cur = db.execute(
+                        "INSERT INTO user (name, password) VALUES (?, ?)",
+                        (name, password_hash),
+                    )
+                    # user_id of the newly inserted user, no need to SELECT it again
+                    user_id = cur.lastrowid
+
+                    # Insert into requester table with the user_id
+                    db.execute(
+                        "INSERT INTO requester (user_id, region, location) VALUES (?, ?, ?)",
+                        (user_id, region, location),
+                    )
+            except db.IntegrityError: # User name already exists, already rolled back
                 error = f"User {name} is already registered."
             else:
                 return redirect(url_for("auth.login"))
@@ -82,12 +123,25 @@ def login():
         error = None
         user = db.execute("SELECT * FROM user WHERE name = ?", (name,)).fetchone()
 
-        if user is None:
-            error = "Name not found."
-        elif not check_password_hash(user["password"], password): # Verify hashed password, not plain text for security
-            error = "Incorrect password."
+        # Always verify a hash, even for unknown names, so both failure paths take the same time
+        # Verify hashed password, not plain text for security
+        password_ok = verify_password(
+            user["password"] if user is not None else _DUMMY_HASH, password
+        )
+
+        # One message for both failures, so the response doesn't reveal which names exist
+        if not (user is not None and password_ok):
+            error = "Incorrect name or password."
 
         if error is None:
+            # Upgrade old hashes while the plain password is available, so later logins
+            # verify against Argon2id instead of the slower werkzeug hash
+            if password_needs_rehash(user["password"]):
+                db.execute(
+                    "UPDATE user SET password = ? WHERE user_id = ?",
+                    (hash_password(password), user["user_id"]),
+                )
+
             session.clear()
             session["user_id"] = user["user_id"]
             return redirect(url_for("index"))
@@ -101,21 +155,47 @@ def login():
 def load_logged_in_user():
     """
     Loads the logged-in user's information from the database into 'g.user'.
+    Also caches whether they are a certifier and their requester id and region on 'g',
+    since these can't change during a request and are needed by most views.
     """
+    # Static files never use the user, so don't read the session or query for them
+    if request.endpoint == "static":
+        return
+
     user_id = session.get("user_id")
 
     if user_id is None:
         g.user = None
     else:
+        # One query for the user, their requester row (if any) and whether they are a certifier
+        # EXISTS stops at the first matching certifier row instead of joining it in
         g.user = (
             get_db()
             .execute(
-                "SELECT * FROM user WHERE user_id = ?",
+                """
+                SELECT
+                    u.*,
+                    r.requester_id,
+                    COALESCE(r.region, 0) AS region, -- Certifiers have no region
+                    EXISTS (SELECT 1 FROM certifier c WHERE c.user_id = u.user_id) AS is_certifier
+                FROM user u
+                LEFT JOIN requester r ON r.user_id = u.user_id
+                WHERE u.user_id = ?
+                """,
                 (user_id,),
             )
             .fetchone()
         )
 
+    if g.user is None:
+        g.is_certifier = False
+        g.requester_id = None
+        g.region = None
+    else:
+        g.is_certifier = bool(g.user["is_certifier"])
+        g.requester_id = g.user["requester_id"]
+        g.region = g.user["region"]
+
 
 @bp.route("/logout")
 def logout():
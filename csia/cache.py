@@ -0,0 +1,4 @@
+from flask_caching import Cache
+
+# In-process cache for read-heavy queries, set up in create_app (see __init__.py)
+cache = Cache()
@@ -1,61 +1,200 @@
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
 import click
 from flask import current_app, g
 
-from werkzeug.security import generate_password_hash
+
+# Database files already switched to WAL by this process
+# journal_mode is stored in the database file itself, so it only needs setting once
+_wal_databases = set()
+
+# Connection pools by database file, shared by every worker thread in the process
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connect(database):
+    """
+    Opens a new connection to the database file and applies the connection settings.
+    """
+    # Timestamps are read back as ISO strings, not converted to datetime on every row
+    db = sqlite3.connect(
+        database,
+        check_same_thread=False,  # Pooled connections move between worker threads
+        cached_statements=256,  # Room for every statement the app uses, so none are recompiled
+        # Autocommit: single statements commit on their own, and views that make several
+        # changes run them inside write_transaction()
+        isolation_level=None,
+    )
+    db.row_factory = sqlite3.Row
+
+    # WAL lets commits append to the log instead of rewriting the journal,
+    # and readers don't block the writer
+    if database not in _wal_databases:
+        db.execute("PRAGMA journal_mode=WAL")
+        _wal_databases.add(database)
+
+    # These settings only last for the connection, so they are set on every connect
+    db.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, skips fsync on each commit
+    db.execute("PRAGMA temp_store=MEMORY")
+    db.execute("PRAGMA mmap_size=268435456")  # 256 MiB
+    db.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+    db.execute("PRAGMA foreign_keys=ON")
+
+    return db
+
+
+class ConnectionPool:
+    """
+    Keeps open connections to one database file, so each request doesn't pay for
+    opening the file and setting up the connection, and page caches are kept.
+    A request takes a connection for as long as it runs and then puts it back.
+    """
+
+    def __init__(self, database, max_size):
+        # queue.Queue treats a size of 0 or less as unbounded, which would keep every connection
+        if max_size < 1:
+            raise ValueError(f"DATABASE_POOL_SIZE must be at least 1, got {max_size}")
+
+        self.database = database
+        # Idle connections, at most max_size are kept
+        self._idle = queue.Queue(max_size)
+
+    def get(self):
+        """
+        Takes an idle connection, or opens a new one if they are all in use.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.database)
+
+    def put(self, db):
+        """
+        Returns a connection for reuse, closing it if enough are already idle.
+        """
+        try:
+            self._idle.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+
+def get_pool():
+    """
+    Gets the connection pool for the app's database, creating it on first use.
+    """
+    database = current_app.config["DATABASE"]
+    pool = _pools.get(database)
+
+    if pool is None:
+        with _pools_lock:  # Two threads starting at once must not create two pools
+            pool = _pools.get(database)
+            if pool is None:
+                pool = _pools[database] = ConnectionPool(
+                    database, current_app.config["DATABASE_POOL_SIZE"]
+                )
+
+    return pool
 
 
 # Boilerplate database connection code
 def get_db():
     """
-    Opens a new database connection if there is none yet.
+    Gets the request's connection to the database, taking one from the pool if it has none yet.
     Used in many functions in the program to access the database. 
     """
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().get()
 
     return g.db
 
 
 def close_db(e=None):
     """
-    Closes the database connection.
+    Ends the request's use of the database connection.
+    The connection goes back to the pool instead of being closed, so anything left
+    uncommitted is rolled back first.
     """
     db = g.pop("db", None)
 
-    if db is not None:
-        db.close()
+    if db is None:
+        return
+
+    # In autocommit mode this is only true if a view returned or failed mid-transaction
+    if db.in_transaction:
+        db.rollback()
+
+    get_pool().put(db)
+
+
+@contextmanager
+def write_transaction():
+    """
+    Runs the statements in the with block as one transaction on the request's connection.
+    Commits when the block finishes, or rolls back and re-raises if it raises.
+    """
+    db = get_db()
+
+    # Take the write lock up front, rather than upgrading to it mid-transaction
+    # where a concurrent writer would make this fail with "database is locked"
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        db.rollback()
+        raise
+    else:
+        db.commit()
+
+
+# Certifier users inserted into the database by init-db, as (name, password)
+# New certifiers can be added using "add-certifier" route in this prototype 
+# application, but is not a full implementation
+DEFAULT_CERTIFIERS = [("certifier1", "certifier1password")]
+
+# Slots each region starts with, and is reset to every day, as (region, slots)
+DEFAULT_SLOTS = [(1, 25), (2, 15)]
 
 
 def init_db():
     """
-    Initializes the database by creating tables and inserting a default certifier.
+    Initializes the database by creating tables and inserting the default certifiers
+    and every region's slot row, so requests never have to create them.
+    Everything is written in a single transaction.
     """
+    from csia.auth import hash_password
+
     db = get_db()
 
-    # Runs schema to create tables
+    # Hash before starting the transaction, so the database isn't locked while hashing
+    certifier_users = [
+        (name, hash_password(password)) for name, password in DEFAULT_CERTIFIERS
+    ]
+
+    # Runs schema to create tables, leaving the transaction open for the inserts below
     with current_app.open_resource("schema.sql") as f:
-        db.executescript(f.read().decode("utf8"))
-
-    # Certifier user creation
-    # Insert a default certifier user into the database    
-    # New certifiers can be added using "add-certifier" route in this prototype 
-    # application, but is not a full implementation
-    db.execute(
-        "INSERT INTO user (name, password) VALUES (?, ?)",
-        ("certifier1", generate_password_hash("certifier1password")),
-    )
-    user_id = db.execute(
-        "SELECT user_id FROM user WHERE name = ?", ("certifier1",)
-    ).fetchone()["user_id"]
-    db.execute("INSERT INTO certifier (user_id) VALUES (?)", (user_id,))
+        db.executescript("BEGIN;\n" + f.read().decode("utf8"))
 
-    db.commit()
+    now = int(time.time())
+
+    # Certifier user and slot creation, committed together with the schema
+    with db:
+        db.executemany(
+            "INSERT INTO user (name, password) VALUES (?, ?)", certifier_users
+        )
+        db.executemany(
+            "INSERT INTO certifier (user_id) SELECT user_id FROM user WHERE name = ?",
+            [(name,) for name, _ in certifier_users],
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO slots (region, slots_left, last_updated) VALUES (?, ?, ?)",
+            [(region, slots, now) for region, slots in DEFAULT_SLOTS],
+        )
 
 
 @click.command(
@@ -67,8 +206,8 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
-sqlite3.register_converter(  # Tell python how to interpret timestamp values in database
-    "timestamp", lambda v: datetime.fromisoformat(v.decode())
+sqlite3.register_adapter(  # Tell python how to store datetime values, same layout as CURRENT_TIMESTAMP
+    datetime, lambda d: d.isoformat(" ")
 )
 
 
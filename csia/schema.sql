@@ -1,7 +1,9 @@
-DROP TABLE IF EXISTS user;
+-- Dropped in dependency order, since foreign keys are enforced
+DROP VIEW IF EXISTS v_visible_tasks;
+DROP TABLE IF EXISTS tasks;
 DROP TABLE IF EXISTS requester;
 DROP TABLE IF EXISTS certifier;
-DROP TABLE IF EXISTS tasks;
+DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS slots;
 
 CREATE TABLE user (
@@ -39,13 +41,77 @@ CREATE TABLE tasks (
     FOREIGN KEY (certifier_id) REFERENCES certifier(certifier_id)
 );
 
+-- Indexes for the dashboard task queries and the joins from user to requester/certifier
+-- Each branch of v_visible_tasks seeks on one of the status indexes (certifiers)
+-- or on idx_tasks_requester_status (requesters)
+-- idx_tasks_requester_status also serves lookups by requester_id alone
+CREATE INDEX idx_tasks_status_time ON tasks(status, time_submitted DESC);
+CREATE INDEX idx_tasks_status_completed ON tasks(status, time_completed);
+CREATE INDEX idx_tasks_status_rejected ON tasks(status, time_rejected);
+CREATE INDEX idx_tasks_requester_status ON tasks(requester_id, status, time_submitted DESC);
+CREATE INDEX idx_tasks_certifier ON tasks(certifier_id);
+CREATE INDEX idx_requester_user ON requester(user_id);
+CREATE INDEX idx_certifier_user ON certifier(user_id);
+
+-- Tasks shown on the index page: all active tasks, plus inactive (completed or rejected)
+-- tasks from today, with the columns task_card.html shows
+-- One branch per status, so each can seek on (status, time) instead of one OR over
+-- every row. A task is completed or rejected after it was submitted, so checking
+-- time_completed/time_rejected also covers tasks submitted today.
+-- Timestamps are stored in UTC, so they are compared against the UTC time of local
+-- midnight instead of calling DATE() on every row; none are ever in the future.
+-- unlikely() tells the planner that few rows are from today, otherwise it prefers
+-- idx_tasks_status_time (which avoids sorting) and reads every completed task
+CREATE VIEW v_visible_tasks AS
+SELECT
+    t.task_id,
+    t.task_name,
+    t.description,
+    t.project_number,
+    t.status,
+    t.time_submitted,
+    t.requester_id,
+    ru.name AS requester_name,
+    r.region
+FROM tasks t
+JOIN requester r ON t.requester_id = r.requester_id
+JOIN user ru ON r.user_id = ru.user_id
+WHERE t.status = 'active'
+UNION ALL
+SELECT
+    t.task_id,
+    t.task_name,
+    t.description,
+    t.project_number,
+    t.status,
+    t.time_submitted,
+    t.requester_id,
+    ru.name AS requester_name,
+    r.region
+FROM tasks t
+JOIN requester r ON t.requester_id = r.requester_id
+JOIN user ru ON r.user_id = ru.user_id
+WHERE t.status = 'completed'
+AND unlikely(t.time_completed >= datetime('now', 'localtime', 'start of day', 'utc'))
+UNION ALL
+SELECT
+    t.task_id,
+    t.task_name,
+    t.description,
+    t.project_number,
+    t.status,
+    t.time_submitted,
+    t.requester_id,
+    ru.name AS requester_name,
+    r.region
+FROM tasks t
+JOIN requester r ON t.requester_id = r.requester_id
+JOIN user ru ON r.user_id = ru.user_id
+WHERE t.status = 'rejected'
+AND unlikely(t.time_rejected >= datetime('now', 'localtime', 'start of day', 'utc'));
+
 CREATE TABLE slots (
     region INTEGER PRIMARY KEY,
     slots_left INTEGER NOT NULL,
-    last_updated TIMESTAMP NOT NULL
+    last_updated INTEGER NOT NULL -- Unix seconds (UTC)
 );
-
-INSERT INTO slots (region, slots_left, last_updated)
-VALUES (1, 25, CURRENT_TIMESTAMP),
-       (2, 15, CURRENT_TIMESTAMP);
-
@@ -22,9 +22,7 @@ setInterval(() => {
     refreshSlots(2);
 }, 300000); // 5 minutes
 
-// Initial refresh on page load
-refreshSlots(1);
-refreshSlots(2);
+// No refresh on page load, the counts were just rendered into the page by the server
 
 // Auto-refresh page for certifier every 1 min
 if (window.is_certifier) {
@@ -1,227 +1,305 @@
+import time
 from datetime import datetime, timezone
 
 from flask import (
     Blueprint,
+    current_app,
     flash,
     g,
     redirect,
     render_template,
     request,
+    stream_with_context,
     url_for,
     jsonify,
 )
 from werkzeug.exceptions import abort
-from werkzeug.security import generate_password_hash
 
-from csia.auth import login_required
-from csia.db import get_db
+from csia.auth import hash_password, login_required
+from csia.cache import cache
+from csia.db import DEFAULT_SLOTS, get_db, write_transaction
 
 bp = Blueprint("tasks", __name__)
 
+# slots.last_updated is stored as unix seconds (UTC), so slot timing is plain integer maths
+SLOT_INTERVAL_SECONDS = 30 * 60  # One slot is lost per 30 minutes
+SECONDS_PER_DAY = 24 * 60 * 60
 
-def check_if_certifier():
-    """
-    Checks if the current user is a certifier.
-    Returns True if certifier, False otherwise.
-    """
-    db = get_db()
+# How long slot counts are served from the cache before being read from the database again
+# Views that change a region's slots store the new count straight away (see set_slot_cache)
+SLOT_CACHE_TIMEOUT = 15
 
-    is_certifier = (
-        db.execute( # db.execute allows program to access database by executing SQL queries
-            "SELECT 1 FROM certifier WHERE user_id = ?", (g.user["user_id"],)
-        ).fetchone()
-        is not None
-    )
+# Each region's daily slots, from the same list init-db creates the slot rows from
+SQL_DEFAULT_SLOTS = (
+    "CASE region "
+    + " ".join(f"WHEN {region} THEN {slots}" for region, slots in DEFAULT_SLOTS)
+    + " ELSE 0 END"
+)
 
-    return is_certifier
+# Slots left in a region once time is taken into account: one less per full interval
+# passed since last_updated, or, if last_updated is from an earlier (UTC) day, the
+# region's default less one per full interval passed since midnight.
+# Only writes store this back (and move last_updated), so reading slots never writes.
+SQL_SLOTS_LEFT = f"""
+    CASE
+        WHEN last_updated / {SECONDS_PER_DAY} != :now / {SECONDS_PER_DAY}
+            THEN max(
+                0,
+                {SQL_DEFAULT_SLOTS}
+                - (:now % {SECONDS_PER_DAY}) / {SLOT_INTERVAL_SECONDS}
+            )
+        ELSE max(0, slots_left - max(0, (:now - last_updated) / {SLOT_INTERVAL_SECONDS}))
+    END
+"""
+
+# SQL used by the task and slot views, defined once so each statement is the same string
+# on every call and the connection's prepared statement cache keeps one compiled copy
+
+# {{regions}} is filled in with one :regionN placeholder per region
+SQL_GET_SLOTS = f"""
+    SELECT region, {SQL_SLOTS_LEFT} AS slots_left
+    FROM slots
+    WHERE region IN ({{regions}})
+"""
+# Slot changes return the new count, so it can be cached without reading it back
+SQL_TAKE_SLOT = f"""
+    UPDATE slots SET slots_left = {SQL_SLOTS_LEFT} - 1, last_updated = :now
+    WHERE region = :region
+    RETURNING slots_left
+"""
+# Takes a slot only if one is left; no row returned means none were, so checking
+# and taking is one statement and two requests can't both take the last slot
+SQL_TAKE_FREE_SLOT = f"""
+    UPDATE slots SET slots_left = {SQL_SLOTS_LEFT} - 1, last_updated = :now
+    WHERE region = :region AND {SQL_SLOTS_LEFT} > 0
+    RETURNING slots_left
+"""
+SQL_RETURN_SLOT = f"""
+    UPDATE slots SET slots_left = {SQL_SLOTS_LEFT} + 1, last_updated = :now
+    WHERE region = :region
+    RETURNING slots_left
+"""
+# Manual slot change from update_slots, read and written in one statement so
+# concurrent changes can't overwrite each other; decrementing stops at 0
+SQL_CHANGE_SLOTS = f"""
+    UPDATE slots SET
+        slots_left = CASE :action
+            WHEN 'increment' THEN {SQL_SLOTS_LEFT} + 1
+            WHEN 'decrement' THEN max(0, {SQL_SLOTS_LEFT} - 1)
+            ELSE {SQL_SLOTS_LEFT}
+        END,
+        last_updated = :now
+    WHERE region = :region
+    RETURNING slots_left
+"""
+SQL_GET_TASK = """
+    SELECT
+        t.task_id,
+        t.task_name,
+        t.description,
+        t.project_number,
+        t.time_completed,
+        t.time_rejected,
+        t.status,
+        ru.name AS requester_name,
+        cu.name AS certifier_name,
+        t.requester_id,
+        r.region,
+        t.requester_id IS ? AS is_owner
+    FROM tasks t
+    JOIN requester r ON t.requester_id = r.requester_id
+    JOIN user ru ON r.user_id = ru.user_id
+    LEFT JOIN certifier c ON t.certifier_id = c.certifier_id
+    LEFT JOIN user cu ON c.user_id = cu.user_id
+    WHERE t.task_id = ?
+"""
+# Index page tasks, from the view of active and today's tasks (see schema.sql)
+# Certifiers see every requester's tasks, optionally only one region's
+# The region is checked on the visible rows after the status/time index seeks,
+# which leave few rows, so it has no index of its own
+SQL_CERTIFIER_DASHBOARD_TASKS = """
+    SELECT * FROM v_visible_tasks
+    WHERE :region IS NULL OR region = :region
+    ORDER BY time_submitted DESC
+"""
+# Requesters only see their own tasks
+SQL_REQUESTER_DASHBOARD_TASKS = """
+    SELECT * FROM v_visible_tasks
+    WHERE requester_id = :requester_id
+    ORDER BY time_submitted DESC
+"""
+SQL_UPDATE_TASK = (
+    "UPDATE tasks SET task_name = ?, description = ?, project_number = ? WHERE task_id = ?"
+)
+# Only deletes the task if it belongs to the requester, so no separate ownership check is needed
+SQL_DELETE_TASK = "DELETE FROM tasks WHERE task_id = ? AND requester_id IS ?"
+SQL_COMPLETE_TASK = (
+    "UPDATE tasks SET status = 'completed', time_completed = ? WHERE task_id = ?"
+)
+SQL_INSERT_TASK = (
+    "INSERT INTO tasks (task_name, description, project_number, requester_id, certifier_id)"
+    " VALUES (?, ?, ?, ?, ?)"
+)
+SQL_REACTIVATE_REJECTED_TASK = (
+    "UPDATE tasks SET status = 'active', time_rejected = NULL WHERE task_id = ?"
+)
+# Status changes made by the certifier, which return the requester's region so the
+# slot count can be updated without looking the task up first (no row means no such task)
+SQL_REJECT_TASK = """
+    UPDATE tasks SET status = 'rejected', time_rejected = ?
+    WHERE task_id = ?
+    RETURNING (SELECT region FROM requester WHERE requester_id = tasks.requester_id) AS region
+"""
+SQL_REACTIVATE_TASK = """
+    UPDATE tasks SET status = 'active', time_rejected = NULL, time_completed = NULL
+    WHERE task_id = ?
+    RETURNING (SELECT region FROM requester WHERE requester_id = tasks.requester_id) AS region
+"""
 
 
-def get_region(user_id):
+@bp.before_app_request
+def set_request_time():
     """
-    Retrieves the region of a user by their user ID.
-    Returns 0 for certifiers, or the requester's region.
+    Stores the current time for the request, read from the clock once:
+    'g.now_utc' as a UTC datetime for task timestamps, and 'g.now_seconds' as
+    unix seconds for slot timing. Every row changed by a request gets this same time.
     """
-    db = get_db()
-    region = 0
-
-    is_certifier = db.execute(
-        "SELECT 1 FROM certifier WHERE user_id = ?", (user_id,)
-    ).fetchone() is not None
-
-    if not is_certifier:
-        region = db.execute(
-            """
-            SELECT region
-            FROM requester
-            WHERE user_id = ?
-            """,
-            (user_id,),
-        ).fetchone()["region"]
+    now = time.time()
+    g.now_seconds = int(now)
+    g.now_utc = datetime.fromtimestamp(now, timezone.utc)
 
-    return region
 
-
-def get_user_region():
+@bp.app_template_filter("timestamp")
+def format_timestamp(value, format="%H:%M %d.%m.%Y"):
     """
-    Retrieves the region of the current user.
+    Formats a timestamp string from the database for display in templates.
+    Timestamps are only parsed into datetimes here, where they are actually shown.
     """
-    user_id = g.user["user_id"]
-    region = 0
+    return datetime.fromisoformat(value).strftime(format)
 
-    if not check_if_certifier():
-        region = get_region(user_id)
 
-    return region
+def get_slot_cache_key(region):
+    """
+    Returns the cache key for a region's slot count.
+    """
+    return f"slots_left/{region}"
 
 
-def check_slots_exist(region):
+def clear_slot_cache(region):
     """
-    Ensures that slot counts for the specified region exist in the database.
-    If not, initializes them to default values.
+    Clears the cached slot count for a region, after its slots have been changed.
     """
-    db = get_db()
-    now = datetime.now(timezone.utc)
+    cache.delete(get_slot_cache_key(region))
 
-    row = db.execute(
-        "SELECT slots_left, last_updated FROM slots WHERE region = ?", (region,)
-    ).fetchone()
-
-    # If region slot counts are not initialized, set to default values
-    if row is None:
-        default_slots = 25 if region == 1 else 15
-        db.execute(
-            "INSERT INTO slots (region, slots_left, last_updated) VALUES (?, ?, ?)",
-            (region, default_slots, now),
-        )
-        db.commit()
-        return default_slots
 
-    
-def get_last_updated(region):
+def set_slot_cache(region, slot):
     """
-    Retrieves the last updated timestamp for the specified region slots from the database.
+    Stores a region's new slot count in the cache after it has been changed, so the
+    next read doesn't have to query for it.
+    'slot' is the row returned by the slot UPDATE, or None if the region has no slot row.
     """
-    db = get_db()
-
-    last_updated = db.execute(
-        "SELECT last_updated FROM slots WHERE region = ?", (region,)
-    ).fetchone()['last_updated']
+    if slot is None:
+        clear_slot_cache(region)
+    else:
+        cache.set(get_slot_cache_key(region), slot["slots_left"], timeout=SLOT_CACHE_TIMEOUT)
 
-    # Ensure last_updated is timezone-aware
-    if last_updated is not None and last_updated.tzinfo is None:
-        last_updated = last_updated.replace(tzinfo=timezone.utc)
-    
-    return last_updated
 
-    
-def update_slots_count(region, slots_left):
+def get_slot_counts(regions):
     """
-    Decrements slots based on 30-minute intervals since last update.
-    Resets slots daily to default values (25 for region 1, 15 for region 2).
+    Retrieves the slot counts for the given regions as a dict of region -> slots left.
+    Slot rows are created by init-db, so a region without one (such as a certifier's
+    region 0) has no slots. The daily reset and 30-minute decrements are worked out
+    when reading (see SQL_SLOTS_LEFT), so this never writes to the database.
+    Counts are cached for a few seconds, and only regions not in the cache are queried.
     """
+    cached = cache.get_many(*(get_slot_cache_key(region) for region in regions))
+    slot_counts = {
+        region: slots_left
+        for region, slots_left in zip(regions, cached)
+        if slots_left is not None
+    }
+    missing = [region for region in regions if region not in slot_counts]
+
+    if not missing:
+        return slot_counts
+
     db = get_db()
-    now = datetime.now(timezone.utc)
 
-    last_updated = get_last_updated(region)
+    params = {"now": g.now_seconds}
+    params.update({f"region{i}": region for i, region in enumerate(missing)})
+    placeholders = ", ".join(f":region{i}" for i in range(len(missing)))
 
-    # Reset slots daily
-    if now.date() != last_updated.date(): # If the date has changed since last update
-        slots_left = 25 if region == 1 else 15
-        db.execute(
-            "UPDATE slots SET slots_left = ?, last_updated = ? WHERE region = ?",
-            (slots_left, now, region),
-        )
-        db.commit()
-        return slots_left
-
-    # Calculate how many 30-minute intervals have passed, if the date is the same 
-    interval_minutes = 30
-
-    # Calculate time difference in minutes since last update
-    delta_minutes = (now - last_updated).total_seconds() // 60
-    decrements = int(delta_minutes // interval_minutes)
-
-    # If intervals have passed, decrement slots accordingly
-    if decrements > 0:
-        slots_left = max(0, slots_left - decrements)
-        db.execute(
-            "UPDATE slots SET slots_left = ?, last_updated = ? WHERE region = ?",
-            (slots_left, now, region),
-        )
-        db.commit()
-        print(f"Decremented slots by {decrements}.") # Debugging statement
+    rows = db.execute(SQL_GET_SLOTS.format(regions=placeholders), params).fetchall()
+    fetched = dict.fromkeys(missing, 0)
+    fetched.update((row["region"], row["slots_left"]) for row in rows)
+
+    cache.set_many(
+        {get_slot_cache_key(region): slots_left for region, slots_left in fetched.items()},
+        timeout=SLOT_CACHE_TIMEOUT,
+    )
+    slot_counts.update(fetched)
 
-    return slots_left
+    return slot_counts
 
 
 def get_slot_count(region):
     """
     Retrieves the slot count for a given region.
     """
-    db = get_db()
-    
-    check_slots_exist(region)
-
-    # Retrieve current slots
-    row = db.execute(
-        "SELECT slots_left, last_updated FROM slots WHERE region = ?", (region,)
-    ).fetchone()
-
-    slots_left = row["slots_left"]
-
-    # Update slots based on time elapsed
-    slots_left = update_slots_count(region, slots_left)
-
-    return slots_left
+    return get_slot_counts((region,))[region]
 
 
 def get_task(task_id, check_author=True):
     """
     Retrieves a task by its ID.
     If check_author is True, verifies that the current user is the requester of the task.
+    Certifiers can access every task, so they are never checked.
     """
-    task = (
-        get_db()
-        .execute(
-            """
-            SELECT 
-                t.task_id,
-                t.task_name,
-                t.description,
-                t.project_number,                
-                t.time_completed,
-                t.time_rejected,
-                t.status,
-                ru.name AS requester_name,
-                cu.name AS certifier_name,
-                t.requester_id
-            FROM tasks t
-            JOIN requester r ON t.requester_id = r.requester_id
-            JOIN user ru ON r.user_id = ru.user_id
-            LEFT JOIN certifier c ON t.certifier_id = c.certifier_id
-            LEFT JOIN user cu ON c.user_id = cu.user_id
-            WHERE t.task_id = ?
-            """,
-            (task_id,),
-        )
-        .fetchone()
-    )
+    task = get_db().execute(SQL_GET_TASK, (g.requester_id, task_id)).fetchone()
 
     # Task not found
     if task is None:
         abort(404, f"Task id {task_id} doesn't exist.")
 
+    # Check that the user is allowed to access the task, using is_owner from the same query
+    if check_author and not g.is_certifier and not task["is_owner"]:
+        abort(403)
+
+    return task
+
+
+@cache.memoize(timeout=20)
+def get_dashboard_tasks(requester_id, is_certifier, region=None):
+    """
+    Retrieves the tasks shown on the index page: all active tasks and those updated today.
+    Certifiers get every requester's tasks, or only one region's if region is given;
+    requesters only get their own.
+    Results are cached briefly, and cleared by every view that changes a task.
+    """
     db = get_db()
 
-    # Check that the user is allowed to access the task    
-    requester_id = db.execute(
-        "SELECT requester_id FROM requester WHERE user_id = ?", (g.user["user_id"],)
-    ).fetchone()["requester_id"]
+    params = {
+        "requester_id": requester_id,
+        "region": region,
+    }
+
+    if is_certifier:
+        # Certifier gets all tasks, including all active and today's inactive (completed or rejected) tasks
+        tasks = db.execute(SQL_CERTIFIER_DASHBOARD_TASKS, params).fetchall()
+    else:
+        # Requester only gets their own tasks that are active or sumbitted today
+        tasks = db.execute(SQL_REQUESTER_DASHBOARD_TASKS, params).fetchall()
+
+    # Plain dicts so the rows can be stored in the cache
+    return [dict(task) for task in tasks]
 
-    if check_author and task["requester_id"] != requester_id:
-        abort(403)
 
-    return task
+def clear_dashboard_cache():
+    """
+    Clears all cached index page task lists, since a changed task can appear in
+    both its requester's and the certifiers' lists.
+    """
+    cache.delete_memoized(get_dashboard_tasks)
 
 
 @bp.route("/")
@@ -231,66 +309,29 @@ def index():
     Displays a list of tasks.  Certifiers see all tasks; requesters see only their own.
     Shows active tasks and those updated today.
     """
-    db = get_db()
-
-    is_certifier = check_if_certifier()
+    # Both loaded once per request in load_logged_in_user (see auth.py)
+    is_certifier = g.is_certifier
 
-    region = get_user_region()
+    region = g.region # 0 for certifiers
 
     if is_certifier:
-        # Certifier gets all tasks, including all active and today's inactive (completed or rejected) tasks
-        tasks = db.execute(
-            """
-            SELECT t.*, r.user_id AS requester_id, ru.name AS requester_name, r.region
-            FROM tasks t
-            JOIN requester r ON t.requester_id = r.requester_id
-            JOIN user ru ON r.user_id = ru.user_id
-            WHERE 
-                -- Active tasks
-                t.status = 'active'
-                OR
-                -- Inactive tasks from today
-                (t.status != 'active' AND DATE(t.time_submitted) = DATE('now', 'localtime'))
-                OR 
-                (t.status = 'completed' AND DATE(t.time_completed) = DATE('now', 'localtime'))
-                OR 
-                (t.status = 'rejected' AND DATE(t.time_rejected) = DATE('now', 'localtime'))
-            ORDER BY t.time_submitted DESC
-            """
-        ).fetchall()
+        # Certifiers can narrow the list to one region with ?region=
+        # They all see the same list for it, so they share one cache entry
+        tasks = get_dashboard_tasks(
+            None, True, request.args.get("region", type=int)
+        )
     else:
-        # Requester only gets their own tasks that are active or sumbitted today
-        tasks = db.execute(
-            """
-            SELECT t.*, r.user_id AS requester_id, ru.name AS requester_name, r.region
-            FROM tasks t
-            JOIN requester r ON t.requester_id = r.requester_id
-            JOIN user ru ON r.user_id = ru.user_id
-            WHERE r.user_id = ?
-            AND (
-                t.status = 'active'
-                OR
-                (t.status != 'active' AND DATE(t.time_submitted) = DATE('now', 'localtime'))
-                OR
-                (t.status = 'completed' AND DATE(t.time_completed) = DATE('now', 'localtime'))
-                OR 
-                (t.status = 'rejected' AND DATE(t.time_rejected) = DATE('now', 'localtime'))
-            )
-            ORDER BY t.time_submitted DESC
-            """,
-            (g.user["user_id"],),
-        ).fetchall()
+        tasks = get_dashboard_tasks(g.requester_id, False)
 
-    region1_slots_left = get_slot_count(1)
-    region2_slots_left = get_slot_count(2)
+    slot_counts = get_slot_counts((1, 2))
 
     return render_template(
         "tasks/index.html",
         tasks=tasks,
         is_certifier=is_certifier,
         region=region,
-        region1_slots_left=region1_slots_left,
-        region2_slots_left=region2_slots_left,
+        region1_slots_left=slot_counts[1],
+        region2_slots_left=slot_counts[2],
     )
 
 
@@ -301,66 +342,65 @@ def submit():
     Allows a requester to submit a new task, checking for available slots in their region.
     Enters task details into the database if slots are available.
     """
-    db = get_db()
-    region = get_user_region()
-    slots_left = get_slot_count(region)
+    region = g.region # 0 for certifiers, loaded in load_logged_in_user (see auth.py)
+
+    if request.method == "GET":
+        # The cached count is enough to decide whether to show the form,
+        # a POST checks the database itself before taking a slot
+        slots_left = get_slot_count(region)
 
-    print(f"Slots left: {slots_left} in Region {region}")
+        current_app.logger.debug("Slots left: %d in Region %d", slots_left, region)
 
-    # If no slots left, prevent GET and POST submissions (submitting a task)
-    if request.method == "GET" and slots_left <= 0:
-        flash(f"No available slots in Region {region} left.")
-        return redirect(url_for("tasks.index")) # Redirects back to index page instead of displaying 
+        # If no slots left, prevent opening the form
+        if slots_left <= 0:
+            flash(f"No available slots in Region {region} left.")
+            return redirect(url_for("tasks.index")) # Redirects back to index page instead of displaying 
 
     if request.method == "POST": # For the form submission
         task_name = request.form["task_name"]
         description = request.form["description"]
         project_number = request.form["project_number"]
 
-        error = None
-
-        # Errors are listed in the order the user should encounter them
-        if slots_left <= 0: # No slots left in the region
-            error = f"Sorry, no available slots in Region {region} left."
-        # This error will not be reached if the GET request check is working correctly
-
         if not task_name: # Task name is required because the database lists it as NOT NULL
-            error = "Task name is required." 
+            flash("Task name is required.")
+            return redirect(url_for("tasks.index"))
         # This error will not be reached if the HTML form validation is working correctly
 
-        if error is not None: # There were errors, flash them and redirect back to index page
-            flash(error)
+        requester_id = g.requester_id
+
+        if requester_id is None: 
+            flash("Requester profile not found.")
             return redirect(url_for("tasks.index"))
-        else: # No errors in the form, proceed to attempt insert the task into the database
-            requester_row = db.execute(
-                "SELECT requester_id FROM requester WHERE user_id = ?",
-                (g.user["user_id"],),
+        # This error should not be reached if the authentication system is working correctly, but is included for safety and database integrity
+
+        # The task and its slot are committed together
+        with write_transaction() as db:
+            # Decrement the slot count for the requester's region, if it has a slot left
+            # Checked in the database rather than from the cache
+            slot = db.execute(
+                SQL_TAKE_FREE_SLOT, {"now": g.now_seconds, "region": region}
             ).fetchone()
 
-            if requester_row is None: 
-                flash("Requester profile not found.")
-                return redirect(url_for("tasks.index"))
-            # This error should not be reached if the authentication system is working correctly, but is included for safety and database integrity
-
-            requester_id = requester_row["requester_id"]
-
-            db.execute( # Insert the new task into the database
-                "INSERT INTO tasks (task_name, description, project_number, requester_id, certifier_id) VALUES (?, ?, ?, ?, ?)",
-                (
-                    task_name,
-                    description,
-                    project_number,
-                    requester_id,
-                    1,
-                ),  # certifier_id=1 for default certifier
-            )
-            db.execute( # Decrement the slot count for the requester's region
-                "UPDATE slots SET slots_left = slots_left - 1, last_updated = ? WHERE region = ?",
-                (datetime.now(timezone.utc), region),
-            )
-            db.commit()
+            if slot is not None:
+                db.execute( # Insert the new task into the database
+                    SQL_INSERT_TASK,
+                    (
+                        task_name,
+                        description,
+                        project_number,
+                        requester_id,
+                        1,
+                    ),  # certifier_id=1 for default certifier
+                )
+
+        if slot is None: # No slots left in the region
+            flash(f"Sorry, no available slots in Region {region} left.")
             return redirect(url_for("tasks.index"))
 
+        clear_dashboard_cache()
+        set_slot_cache(region, slot)
+        return redirect(url_for("tasks.index"))
+
     return render_template("tasks/submit.html") 
 
 
@@ -389,28 +429,25 @@ def update(task_id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                "UPDATE tasks SET task_name = ?, description = ?, project_number = ? WHERE task_id = ?",
-                (task_name, description, project_number, task_id),
-            )
-
-            # If the task was rejected, reactivate it and decrement slots
-            if rejected:
-                db.execute( # Reactivate the task
-                    "UPDATE tasks SET status = 'active', time_rejected = NULL WHERE task_id = ?",
-                    (task_id,),
+            with write_transaction() as db:
+                db.execute(
+                    SQL_UPDATE_TASK, (task_name, description, project_number, task_id)
                 )
 
-                region = get_region(task["requester_id"])
+                # If the task was rejected, reactivate it and decrement slots
+                if rejected:
+                    db.execute(SQL_REACTIVATE_REJECTED_TASK, (task_id,)) # Reactivate the task
 
-                db.execute(
-                    "UPDATE slots SET slots_left = slots_left - 1, last_updated = ? WHERE region = ?",
-                    (datetime.now(timezone.utc), region),
-                )
+                    # The slot is taken from the task's region, which is not the
+                    # user's own when a certifier makes the update
+                    slot = db.execute(
+                        SQL_TAKE_SLOT, {"now": g.now_seconds, "region": task["region"]}
+                    ).fetchone()
 
-            db.commit()
-            print("From update: Task updated successfully.") # Debugging statement
+            clear_dashboard_cache()
+            if rejected:
+                set_slot_cache(task["region"], slot)
+            current_app.logger.debug("Task %d updated.", task_id)
             return redirect(url_for("tasks.index"))
 
     return render_template("tasks/update.html", task=task, rejected=rejected) # Pass rejected status to template to change form text
@@ -421,11 +458,16 @@ def update(task_id):
 def delete(task_id):
     """
     Deletes a task from the database by its ID.
+    Only the task's requester can delete it.
     """
-    get_task(task_id)
     db = get_db()
-    db.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
-    db.commit()
+    cur = db.execute(SQL_DELETE_TASK, (task_id, g.requester_id))
+
+    # Nothing deleted: the task doesn't exist, or it isn't the user's
+    if cur.rowcount == 0:
+        abort(404, f"Task id {task_id} doesn't exist.")
+
+    clear_dashboard_cache()
     return redirect(url_for("tasks.index"))
 
 
@@ -435,12 +477,8 @@ def complete_task(task_id):
     """
     Marks a task as completed in the database by updating its status and completion time.
     """
-    db = get_db()
-    db.execute(
-        "UPDATE tasks SET status = 'completed', time_completed = ? WHERE task_id = ?",
-        (datetime.now(timezone.utc), task_id),
-    )
-    db.commit()
+    get_db().execute(SQL_COMPLETE_TASK, (g.now_utc, task_id))
+    clear_dashboard_cache()
     return redirect(url_for("tasks.index"))
 
 
@@ -450,38 +488,20 @@ def reject_task(task_id):
     """
     Marks a task as rejected in the database and increments the slot count for the requester's region.
     """
-    db = get_db()
+    with write_transaction() as db:
+        task = db.execute(SQL_REJECT_TASK, (g.now_utc, task_id)).fetchone()
 
-    task = db.execute(
-        """
-        SELECT r.region
-        FROM tasks t
-        JOIN requester r ON t.requester_id = r.requester_id
-        WHERE t.task_id = ?
-        """,
-        (task_id,),
-    ).fetchone()
+        if task:
+            slot = db.execute(
+                SQL_RETURN_SLOT, {"now": g.now_seconds, "region": task["region"]}
+            ).fetchone()
 
     if not task:
         flash("Task not found.")
         return redirect(url_for("tasks.index"))
 
-    region = task["region"]
-
-    db.execute(
-        "UPDATE tasks SET status = 'rejected', time_rejected = ? WHERE task_id = ?",
-        (
-            datetime.now(timezone.utc),
-            task_id,
-        ),
-    )
-
-    db.execute(
-        "UPDATE slots SET slots_left = slots_left + 1, last_updated = ? WHERE region = ?",
-        (datetime.now(timezone.utc), region),
-    )
-
-    db.commit()
+    clear_dashboard_cache()
+    set_slot_cache(task["region"], slot)
     return redirect(url_for("tasks.index"))
 
 
@@ -493,45 +513,24 @@ def reactivate_task(task_id):
     Decrements the slot count for the requester's region.
     Used by the certifier to reactivate tasks.
     """
-    db = get_db()
+    # Clearing both timestamps covers rejected and completed tasks in one statement,
+    # since only the one matching the current status is ever set
+    with write_transaction() as db:
+        task = db.execute(SQL_REACTIVATE_TASK, (task_id,)).fetchone()
 
-    task = db.execute(
-        """
-        SELECT t.task_id, t.status, r.region
-        FROM tasks t
-        JOIN requester r ON t.requester_id = r.requester_id
-        WHERE t.task_id = ?
-        """,
-        (task_id,),
-    ).fetchone()
+        if task:
+            slot = db.execute(
+                SQL_TAKE_SLOT, {"now": g.now_seconds, "region": task["region"]}
+            ).fetchone()
 
     if not task:
         flash("Task not found.")
         return redirect(url_for("tasks.index"))
 
-    region = task["region"]
-    rejected = task["status"] == "rejected"
-    completed = task["status"] == "completed"
-
-    if rejected:
-        db.execute(
-            "UPDATE tasks SET status = 'active', time_rejected = NULL WHERE task_id = ?",
-            (task_id,),
-        )
-    elif completed:
-        db.execute(
-            "UPDATE tasks SET status = 'active', time_completed = NULL WHERE task_id = ?",
-            (task_id,),
-        )
-
-    db.execute(
-        "UPDATE slots SET slots_left = slots_left - 1, last_updated = ? WHERE region = ?",
-        (datetime.now(timezone.utc), region),
-    )
-
-    db.commit()
+    clear_dashboard_cache()
+    set_slot_cache(task["region"], slot)
     # flash("Task reactivated.")
-    print("From reactivate_task: Task reactivated successfully.")  # Debugging statement
+    current_app.logger.debug("Task %d reactivated.", task_id)
     return redirect(url_for("tasks.index"))
 
 
@@ -542,21 +541,13 @@ def update_slots(region, action):
     Returns the updated slot count as JSON.
     """
     db = get_db()
+    slot = db.execute(
+        SQL_CHANGE_SLOTS, {"action": action, "now": g.now_seconds, "region": region}
+    ).fetchone()
+    set_slot_cache(region, slot)
 
-    slots_left = get_slot_count(region)
-
-    if action == "increment":
-        slots_left += 1
-    elif action == "decrement" and slots_left > 0:
-        slots_left -= 1
-
-    db.execute(
-        "UPDATE slots SET slots_left = ?, last_updated = ? WHERE region = ?",
-        (slots_left, datetime.now(timezone.utc), region),
-    )
-    db.commit()
-
-    return jsonify({"slots_left": slots_left})
+    # A region without a slot row has no slots
+    return jsonify({"slots_left": slot["slots_left"] if slot is not None else 0})
 
 
 @bp.route("/slots/<int:region>/get", methods=["GET"])
@@ -567,26 +558,62 @@ def get_slots(region):
     Used for Javascript requests to update slot counts dynamically as a Flask route.
     Returns the slot count as JSON.
     """
-    slots_left = get_slot_count(region)
-    return jsonify({"slots_left": slots_left})
+    slots_left = get_slot_count(region) # Usually served from the cache, see get_slot_counts
+
+    response = jsonify({"slots_left": slots_left})
+    # Lets the browser reuse the count for a few seconds instead of asking again
+    # Private, since the route is only for logged in users
+    response.headers["Cache-Control"] = "private, max-age=5"
+    return response
 
 
 # Debugging section
 
 
+def iter_dicts(cur):
+    """
+    Yields the rows of a cursor as dicts, reading the column names once from
+    cursor.description instead of looking up keys on every row.
+    """
+    columns = [column[0] for column in cur.description]
+    for row in cur:
+        yield dict(zip(columns, row))
+
+
 @bp.route("/debug-db")
 def debug_db():
-    db = get_db()
-    users = db.execute("SELECT * FROM user").fetchall()
-    requesters = db.execute("SELECT * FROM requester").fetchall()
-    certifiers = db.execute("SELECT * FROM certifier").fetchall()
-    tasks = db.execute("SELECT * FROM tasks").fetchall()
-    return {
-        "users": [dict(u) for u in users],
-        "requesters": [dict(r) for r in requesters],
-        "certifiers": [dict(c) for c in certifiers],
-        "tasks": [dict(t) for t in tasks],
-    }
+    """
+    Dumps a page of rows from each table as JSON, e.g. /debug-db?limit=100&offset=0.
+    Only available in debug mode, and streamed so whole tables are never held in memory.
+    """
+    if not current_app.debug:
+        abort(404)
+
+    limit = max(request.args.get("limit", 100, type=int), 0)
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    tables = (
+        ("users", "user"),
+        ("requesters", "requester"),
+        ("certifiers", "certifier"),
+        ("tasks", "tasks"),
+    )
+
+    def generate():
+        db = get_db()
+        yield "{"
+        for i, (key, table) in enumerate(tables):
+            cur = db.cursor()
+            cur.row_factory = None  # Plain tuples, iter_dicts adds the column names itself
+            cur.execute(f"SELECT * FROM {table} LIMIT ? OFFSET ?", (limit, offset))
+            yield f'{", " if i else ""}"{key}": ['
+            for j, row in enumerate(iter_dicts(cur)):
+                yield (", " if j else "") + current_app.json.dumps(row)
+            yield "]"
+        yield "}"
+
+    return current_app.response_class(
+        stream_with_context(generate()), mimetype="application/json"
+    )
 
 
 @bp.route("/add-certifier")
@@ -599,17 +626,13 @@ def add_certifier():
         "SELECT user_id FROM user WHERE name = ?", (new_certifier_name,)
     ).fetchone()
     if row is None:
-        db.execute(
-            "INSERT INTO user (name, password) VALUES (?, ?)",
-            (
-                new_certifier_name,
-                generate_password_hash(f"{new_certifier_name}password"),
-            ),
-        )
-        user_id = db.execute(
-            "SELECT user_id FROM user WHERE name = ?", (new_certifier_name,)
-        ).fetchone()["user_id"]
-        db.execute("INSERT INTO certifier (user_id) VALUES (?)", (user_id,))
-        db.commit()
+        password_hash = hash_password(f"{new_certifier_name}password")
+        with write_transaction():
+            cur = db.execute(
+                "INSERT INTO user (name, password) VALUES (?, ?)",
+                (new_certifier_name, password_hash),
+            )
+            user_id = cur.lastrowid
+            db.execute("INSERT INTO certifier (user_id) VALUES (?)", (user_id,))
         return "Certifier created."
     return "Certifier already exists."